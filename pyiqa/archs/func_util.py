@@ -1,3 +1,4 @@
+from functools import lru_cache
 from typing import Tuple
 import torch
 import torch.nn.functional as F
@@ -83,14 +84,27 @@ def diff_round(x: torch.Tensor) -> torch.Tensor:
     return x - x.detach() + x.round()
 
 
+@lru_cache(maxsize=8)
+@torch.inference_mode(False)
+def _gauss_kernel(
+    kernel_size: int, sigma: float, dtype: torch.dtype, device: torch.device
+) -> torch.Tensor:
+    """Gaussian window of normalize_img_with_gauss, cached for each dtype and device
+    so that it is not rebuilt with numpy and copied to the device on every call.
+    Built outside of inference mode so that it can be saved for backward by later calls."""
+    return fspecial(kernel_size, sigma, 1).to(dtype=dtype, device=device)
+
+
 def normalize_img_with_gauss(
     img: torch.Tensor,
     kernel_size: int = 7,
     sigma: float = 7.0 / 6,
     C: int = 1,
     padding: str = "same",
+    kernel: torch.Tensor = None,
 ):
-    kernel = fspecial(kernel_size, sigma, 1).to(img)
+    if kernel is None:
+        kernel = _gauss_kernel(kernel_size, sigma, img.dtype, img.device)
     mu = imfilter(img, kernel, padding=padding)
     std = imfilter(img**2, kernel, padding=padding)
     sigma = safe_sqrt((std - mu**2).abs())
@@ -191,22 +205,37 @@ def estimate_ggd_param(x: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
     return solution, sigma
 
 
+@lru_cache(maxsize=8)
+@torch.inference_mode(False)
+def _aggd_lookup_table(
+    dtype: torch.dtype, device: torch.device
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Candidate shape parameters and their ratio of moments for AGGD estimation,
+    cached for each dtype and device since they are constant. Built outside of
+    inference mode so that they can be saved for backward by later calls."""
+    gam = torch.arange(0.2, 10 + 0.001, 0.001).to(dtype=dtype, device=device)
+    r_gam = (
+        2 * torch.lgamma(2.0 / gam)
+        - (torch.lgamma(1.0 / gam) + torch.lgamma(3.0 / gam))
+    ).exp()
+    return gam, r_gam
+
+
 def estimate_aggd_param(
-    block: torch.Tensor, return_sigma=False
+    block: torch.Tensor, return_sigma=False, lookup_table=None
 ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
     """Estimate AGGD (Asymmetric Generalized Gaussian Distribution) parameters.
     Args:
         block (Tensor): Image block with shape (b, 1, h, w).
+        lookup_table (tuple): Precomputed (gam, r_gam) of block dtype and device,
+            looked up from the cache if None.
     Returns:
         Tensor: alpha, beta_l and beta_r for the AGGD distribution
         (Estimating the parames in Equation 7 in the paper).
     """
-    gam = torch.arange(0.2, 10 + 0.001, 0.001).to(block)
-    r_gam = (
-        2 * torch.lgamma(2.0 / gam)
-        - (torch.lgamma(1.0 / gam) + torch.lgamma(3.0 / gam))
-    ).exp()
-    r_gam = r_gam.repeat(block.shape[0], 1)
+    if lookup_table is None:
+        lookup_table = _aggd_lookup_table(block.dtype, block.device)
+    gam, r_gam = lookup_table
 
     mask_left = block < 0
     mask_right = block > 0
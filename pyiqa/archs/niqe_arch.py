@@ -13,15 +13,18 @@ ILNIQE Metric
 """
 
 import math
+from contextlib import nullcontext
+from functools import lru_cache, partial
 import numpy as np
 import scipy
 import scipy.io
 import torch
+import torch.nn.functional as F
 
 from pyiqa.utils.color_util import to_y_channel
 from pyiqa.utils.download_util import load_file_from_url
 from pyiqa.matlab_utils import imresize, fspecial, conv2d, imfilter, fitweibull, nancov, nanmean, blockproc
-from .func_util import estimate_aggd_param, normalize_img_with_gauss, diff_round
+from .func_util import estimate_aggd_param, normalize_img_with_gauss, diff_round, _aggd_lookup_table, _gauss_kernel
 from pyiqa.archs.fsim_arch import _construct_filters
 from pyiqa.utils.registry import ARCH_REGISTRY
 from pyiqa.archs.arch_util import get_url_from_name
@@ -33,41 +36,64 @@ default_model_urls = {
     'ilniqe': get_url_from_name('ILNIQE_templateModel.mat'),
 }
 
+# opponent color space transform of ILNIQE, maps RGB to (O1, O2, O3)
+OSPACE_WEIGHT = (
+    (0.3, 0.04, -0.35),
+    (0.34, -0.6, 0.17),
+    (0.06, 0.63, 0.27),
+)
+
+# maps the mean subtracted log RGB channels to (Intensity, BY, RG)
+LOG_OPPONENT_WEIGHT = (
+    (1 / math.sqrt(3), 1 / math.sqrt(3), 1 / math.sqrt(3)),
+    (1 / math.sqrt(6), 1 / math.sqrt(6), -2 / math.sqrt(6)),
+    (1 / math.sqrt(2), -1 / math.sqrt(2), 0.),
+)
+
 
 def compute_feature(
     block: torch.Tensor,
     ilniqe: bool = False,
+    aggd_table=None,
 ) -> torch.Tensor:
     """Compute features.
     Args:
-        block (Tensor): Image block in shape (b, c, h, w).
+        block (Tensor): Image blocks in shape (b, c, h, w), all blocks of a batch
+            are usually stacked in b by :func:`blockproc`.
+        ilniqe (bool): Whether to compute the extra ILNIQE features. Default: False.
+        aggd_table (tuple): AGGD lookup table passed to :func:`estimate_aggd_param`. Default: None.
     Returns:
-        list: Features with length of 18.
+        Tensor: Features in shape (b, 18), or (b, 234) for ILNIQE.
     """
     bsz = block.shape[0]
     aggd_block = block[:, [0]]
-    alpha, beta_l, beta_r = estimate_aggd_param(aggd_block)
+    alpha, beta_l, beta_r = estimate_aggd_param(aggd_block, lookup_table=aggd_table)
     feat = [alpha, (beta_l + beta_r) / 2]
 
     # distortions disturb the fairly regular structure of natural images.
     # This deviation can be captured by analyzing the sample distribution of
     # the products of pairs of adjacent coefficients computed along
     # horizontal, vertical and diagonal orientations.
+    # The four orientations are stacked along the batch dim and estimated together.
     shifts = [[0, 1], [1, 0], [1, 1], [1, -1]]
-    for i in range(len(shifts)):
-        shifted_block = torch.roll(aggd_block, shifts[i], dims=(2, 3))
-        alpha, beta_l, beta_r = estimate_aggd_param(aggd_block * shifted_block)
-        # Eq. 8
-        mean = (beta_r - beta_l) * (torch.lgamma(2 / alpha) - torch.lgamma(1 / alpha)).exp()
-        feat.extend((alpha, mean, beta_l, beta_r))
+    shifted_block = torch.stack([torch.roll(aggd_block, shift, dims=(2, 3)) for shift in shifts])
+    pair_product = (aggd_block.unsqueeze(0) * shifted_block).reshape(len(shifts) * bsz, *aggd_block.shape[1:])
+    alpha_p, beta_l_p, beta_r_p = [
+        x.reshape(len(shifts), bsz) for x in estimate_aggd_param(pair_product, lookup_table=aggd_table)
+    ]
+    # Eq. 8
+    mean_p = (beta_r_p - beta_l_p) * (torch.lgamma(2 / alpha_p) - torch.lgamma(1 / alpha_p)).exp()
+    pair_feat = torch.stack((alpha_p, mean_p, beta_l_p, beta_r_p), dim=-1)  # (shifts, b, 4)
     feat = [x.reshape(bsz, 1) for x in feat]
+    feat.append(pair_feat.transpose(0, 1).reshape(bsz, -1))
 
     if ilniqe:
-        tmp_block = block[:, 1:4]
-        channels = 4 - 1
+        # weibull fits of the gradient magnitude channels 1:4 and 85:109 are done in one batch
+        tmp_block = torch.cat((block[:, 1:4], block[:, 85:109]), dim=1)
+        channels = tmp_block.shape[1]
         shape_scale = fitweibull(tmp_block.reshape(bsz * channels, -1))
-        scale_shape = shape_scale[:, [1, 0]].reshape(bsz, -1)
-        feat.append(scale_shape)
+        scale_shape = shape_scale[:, [1, 0]].reshape(bsz, channels, 2)
+        feat.append(scale_shape[:, :3].reshape(bsz, -1))
 
         mu = torch.mean(block[:, 4:7], dim=(2, 3))
         sigmaSquare = torch.var(block[:, 4:7], dim=(2, 3))
@@ -76,23 +102,39 @@ def compute_feature(
 
         channels = 85 - 7
         tmp_block = block[:, 7:85].reshape(bsz * channels, 1, *block.shape[2:])
-        alpha_data, beta_l_data, beta_r_data = estimate_aggd_param(tmp_block)
+        alpha_data, beta_l_data, beta_r_data = estimate_aggd_param(tmp_block, lookup_table=aggd_table)
         alpha_data = alpha_data.reshape(bsz, channels)
         beta_l_data = beta_l_data.reshape(bsz, channels)
         beta_r_data = beta_r_data.reshape(bsz, channels)
         alpha_beta = torch.stack([alpha_data, (beta_l_data + beta_r_data) / 2], dim=-1).reshape(bsz, -1)
         feat.append(alpha_beta)
 
-        tmp_block = block[:, 85:109]
-        channels = 109 - 85
-        shape_scale = fitweibull(tmp_block.reshape(bsz * channels, -1))
-        scale_shape = shape_scale[:, [1, 0]].reshape(bsz, -1)
-        feat.append(scale_shape)
+        feat.append(scale_shape[:, 3:].reshape(bsz, -1))
 
     feat = torch.cat(feat, dim=-1)
     return feat
 
 
+def _mahalanobis_sq(diff: torch.Tensor, cov: torch.Tensor) -> torch.Tensor:
+    """Squared Mahalanobis distance ``diff @ inv(cov) @ diff^T`` of each row in diff.
+    The covariance is symmetric positive definite in general, so the linear system is
+    solved with its Cholesky factor instead of forming the inverse. Covariances that
+    are not positive definite fall back to the pseudo inverse used by the matlab codes.
+    Args:
+        diff (Tensor): Differences to the mean in shape (b, n, feat_dim).
+        cov (Tensor): Covariance matrices in shape (b, feat_dim, feat_dim).
+    Returns:
+        Tensor: Squared distances in shape (b, n).
+    """
+    try:
+        chol = torch.linalg.cholesky(cov)
+        sol = torch.cholesky_solve(diff.transpose(1, 2), chol).transpose(1, 2)
+    except getattr(torch.linalg, 'LinAlgError', RuntimeError):
+        # torch.linalg.LinAlgError is only available for torch>=1.13
+        sol = torch.bmm(diff, torch.linalg.pinv(cov))
+    return (sol * diff).sum(dim=-1)
+
+
 def niqe(img: torch.Tensor,
          mu_pris_param: torch.Tensor,
          cov_pris_param: torch.Tensor,
@@ -135,14 +177,29 @@ def niqe(img: torch.Tensor,
     cov_distparam = nancov(distparam)
 
     # compute niqe quality, Eq. 10 in the paper
-    invcov_param = torch.linalg.pinv((cov_pris_param + cov_distparam) / 2)
     diff = (mu_pris_param - mu_distparam).unsqueeze(1)
-    quality = torch.bmm(torch.bmm(diff, invcov_param), diff.transpose(1, 2)).squeeze()
+    quality = _mahalanobis_sq(diff, (cov_pris_param + cov_distparam) / 2).squeeze()
 
     quality = torch.sqrt(quality)
     return quality
 
 
+@lru_cache(maxsize=8)
+@torch.inference_mode(False)
+def _load_niqe_params(pretrained_model_path: str):
+    """Load the pristine MVG parameters of NIQE, cached by model path.
+    Loaded outside of inference mode since the cached tensors are shared by all instances.
+    Args:
+        pretrained_model_path (str): The pretrained model path.
+    Returns:
+        tuple: mu_pris_param in shape (feat_dim,) and cov_pris_param in shape (feat_dim, feat_dim).
+    """
+    params = scipy.io.loadmat(pretrained_model_path)
+    mu_pris_param = torch.from_numpy(np.ravel(params['mu_prisparam']))
+    cov_pris_param = torch.from_numpy(params['cov_prisparam'])
+    return mu_pris_param, cov_pris_param
+
+
 def calculate_niqe(img: torch.Tensor,
                    crop_border: int = 0,
                    test_y_channel: bool = True,
@@ -171,8 +228,9 @@ def calculate_niqe(img: torch.Tensor,
     img = diff_round(img)
     img = img.to(torch.float64)
 
-    mu_pris_param = mu_pris_param.to(img).repeat(img.size(0), 1)
-    cov_pris_param = cov_pris_param.to(img).repeat(img.size(0), 1, 1)
+    # broadcast views, niqe only reads the pristine parameters
+    mu_pris_param = mu_pris_param.to(img).expand(img.size(0), -1)
+    cov_pris_param = cov_pris_param.to(img).expand(img.size(0), -1, -1)
 
     if crop_border != 0:
         img = img[..., crop_border:-crop_border, crop_border:-crop_border]
@@ -182,24 +240,197 @@ def calculate_niqe(img: torch.Tensor,
     return niqe_result
 
 
-def gauDerivative(sigma, in_ch=1, out_ch=1, device=None):
+@lru_cache(maxsize=8)
+@torch.inference_mode(False)
+def _gau_derivative_kernels(sigma, dtype, device):
     halfLength = math.ceil(3 * sigma)
+    coords = torch.arange(-halfLength, halfLength + 1, dtype=dtype, device=device)
+    y, x = torch.meshgrid(coords, coords, indexing='ij')
+
+    gau = torch.exp(-(x**2 + y**2) / 2 / sigma / sigma)
+    gauDerX = x * gau
+    gauDerY = y * gau
+    return gauDerX[None, None], gauDerY[None, None]
 
-    x, y = np.meshgrid(
-        np.linspace(-halfLength, halfLength, 2 * halfLength + 1),
-        np.linspace(-halfLength, halfLength, 2 * halfLength + 1))
 
-    gauDerX = x * np.exp(-(x**2 + y**2) / 2 / sigma / sigma)
-    gauDerY = y * np.exp(-(x**2 + y**2) / 2 / sigma / sigma)
+def gauDerivative(sigma, in_ch=1, out_ch=1, device=None):
+    r"""Gaussian derivative kernels in shape (out_ch, in_ch, k, k).
+    Kernels are built directly on the device (and with the dtype) of ``device``,
+    which is usually the input tensor, and cached for each sigma. Do not modify
+    the returned kernels in place.
+    """
+    if isinstance(device, torch.Tensor):
+        dtype, device = device.dtype, device.device
+    else:
+        dtype, device = torch.float64, torch.device('cpu' if device is None else device)
 
-    dx = torch.from_numpy(gauDerX).to(device)
-    dy = torch.from_numpy(gauDerY).to(device)
-    dx = dx.repeat(out_ch, in_ch, 1, 1)
-    dy = dy.repeat(out_ch, in_ch, 1, 1)
+    dx, dy = _gau_derivative_kernels(sigma, dtype, device)
+    if in_ch > 1 or out_ch > 1:
+        dx = dx.repeat(out_ch, in_ch, 1, 1)
+        dy = dy.repeat(out_ch, in_ch, 1, 1)
 
     return dx, dy
 
 
+@lru_cache(maxsize=2)
+@torch.inference_mode(False)
+def _log_gabor_filters(size, min_length, scales, orientations, mult, sigma_f, delta_theta, dtype, device):
+    r"""Log-Gabor filter bank used by ILNIQE, ordered as scale * ori.
+    The filters only depend on the image size and filter parameters, so they are built once and cached.
+    The bank is as large as the image, the cache only keeps the two pyramid scales of the default
+    524x524 pipeline; other sizes (``resize=False``) evict them instead of piling up on the device.
+    It is built outside of inference mode so that it can be saved for backward by later calls.
+    Returns:
+        Tensor: filters in shape (1, scales * orientations, h, w), must not be modified in place.
+    """
+    LGFilters = _construct_filters(
+        torch.empty(1, 1, *size, dtype=dtype, device=device),
+        scales=scales,
+        orientations=orientations,
+        min_length=min_length,
+        sigma_f=sigma_f,
+        mult=mult,
+        delta_theta=delta_theta,
+        use_lowpass_filter=False)
+    # reformat to scale * ori
+    b, _, h, w = LGFilters.shape
+    LGFilters = LGFilters.reshape(b, orientations, scales, h, w).transpose(1, 2).reshape(b, -1, h, w)
+    # TODO: current filters needs to be transposed to get same results as matlab, find the bug
+    LGFilters = LGFilters.transpose(-1, -2).contiguous()
+    return LGFilters
+
+
+@lru_cache(maxsize=4)
+@torch.inference_mode(False)
+def _color_constants(dtype, device):
+    r"""Opponent color transforms of ILNIQE, cached per dtype and device so they
+    are not re-allocated and copied to the device on every call. Built outside of
+    inference mode so that they can be saved for backward by later calls.
+    Returns:
+        tuple: ospace_weight and log_opponent_weight as 1x1 conv weights in shape (3, 3, 1, 1),
+        must not be modified in place.
+    """
+    ospace_weight = torch.tensor(OSPACE_WEIGHT).to(dtype=dtype, device=device).view(3, 3, 1, 1)
+    log_opponent_weight = torch.tensor(LOG_OPPONENT_WEIGHT, dtype=torch.float64).to(dtype=dtype, device=device)
+    log_opponent_weight = log_opponent_weight.view(3, 3, 1, 1)
+    return ospace_weight, log_opponent_weight
+
+
+def _ilniqe_scale_filters(scale: int, size, dtype, device):
+    r"""Constant filters of one scale of the ILNIQE pyramid, built by the lru_cached helpers.
+    They are passed to :func:`_ilniqe_scale_features` instead of being built inside it, because
+    torch.compile traces through lru_cache and would rebuild them in the graph on every call.
+    Returns:
+        tuple: dxy, the x/y Gaussian derivative kernels in shape (2, 1, k, k), and LGFilters, the
+        log-Gabor filters in shape (1, scales * ori, h, w).
+    """
+    sigmaForGauDerivative = 1.66
+    minWaveLength = 2.4
+    sigmaOnf = 0.55
+    mult = 1.31
+    dThetaOnSigma = 1.10
+    scaleFactorForLoG = 0.87
+    scaleFactorForGaussianDer = 0.28
+
+    scales = 3
+    orientations = 4
+
+    dx, dy = _gau_derivative_kernels(sigmaForGauDerivative / (scale**scaleFactorForGaussianDer), dtype, device)
+    dxy = torch.cat((dx, dy))
+    LGFilters = _log_gabor_filters(tuple(size),
+                                   min_length=minWaveLength / (scale**scaleFactorForLoG),
+                                   scales=scales,
+                                   orientations=orientations,
+                                   mult=mult,
+                                   sigma_f=sigmaOnf,
+                                   delta_theta=dThetaOnSigma,
+                                   dtype=dtype,
+                                   device=device)
+    return dxy, LGFilters
+
+
+def _ilniqe_scale_features(O_img: torch.Tensor,
+                           img: torch.Tensor,
+                           dxy: torch.Tensor,
+                           LGFilters: torch.Tensor,
+                           gauss_kernel: torch.Tensor,
+                           aggd_table,
+                           scale: int,
+                           block_size_h: int,
+                           block_size_w: int,
+                           log_opponent_weight: torch.Tensor,
+                           autocast=nullcontext) -> torch.Tensor:
+    """Compute the ILNIQE block features of one scale of the image pyramid.
+    Args:
+        O_img (Tensor): Opponent color channels of the current scale, shape (b, 3, h, w).
+        img (Tensor): RGB channels of the current scale, shape (b, 3, h, w).
+        dxy (Tensor): x/y Gaussian derivative kernels of the scale, shape (2, 1, k, k).
+        LGFilters (Tensor): Log-Gabor filters of the scale, shape (1, scales * ori, h, w).
+        gauss_kernel (Tensor): Gaussian window for the structure normalization, shape (1, 1, 5, 5).
+        aggd_table (tuple): AGGD lookup table of :func:`estimate_aggd_param`.
+        scale (int): Scale of the pyramid, 1 or 2.
+        block_size_h (int): Block height at scale 1.
+        block_size_w (int): Block width at scale 1.
+        log_opponent_weight (Tensor): Log opponent color transform, shape (3, 3, 1, 1).
+        autocast: Context manager for the derivative convolutions. Default: nullcontext.
+    Returns:
+        Tensor: block features in shape (b, block_num, feature_num).
+    """
+    KforLog = 0.00001
+    EPS = 1e-8
+
+    struct_dis = normalize_img_with_gauss(O_img[:, [2]], kernel_size=5, sigma=5. / 6, padding='replicate',
+                                          kernel=gauss_kernel)
+
+    # x/y derivatives of the three opponent channels with one grouped conv,
+    # in the order of (IxO1, IyO1, IxO2, IyO2, IxO3, IyO3)
+    with autocast():
+        Ixy = conv2d(O_img, dxy.repeat(3, 1, 1, 1), groups=3).to(img.dtype)
+    GM_O = torch.sqrt(Ixy[:, 0::2]**2 + Ixy[:, 1::2]**2 + EPS)
+
+    logRGB = torch.log(img + KforLog)
+    logRGBMS = logRGB - logRGB.mean(dim=(2, 3), keepdim=True)
+    # (Intensity, BY, RG) with one 1x1 conv
+    logOpponent = F.conv2d(logRGBMS, log_opponent_weight)
+
+    O3 = O_img[:, [2]]
+    h, w = O3.shape[-2:]
+    fftIm = torch.fft.fft2(O3)
+
+    # responses of all scales and orientations with one batched ifft, interleaved as
+    # (real_1, imag_1, real_2, imag_2, ...)
+    response = torch.view_as_real(torch.fft.ifft2(LGFilters * fftIm))
+    logResponse = response.permute(0, 1, 4, 2, 3).reshape(response.shape[0], -1, h, w)
+
+    # x/y derivatives of every response with one grouped conv, in the order of
+    # (partialXReal_1, partialYReal_1, partialXImag_1, partialYImag_1, ...)
+    num_response = logResponse.shape[1]
+    with autocast():
+        partialDer = conv2d(logResponse, dxy.repeat(num_response, 1, 1, 1), groups=num_response).to(img.dtype)
+    GM = torch.sqrt(partialDer[:, 0::2]**2 + partialDer[:, 1::2]**2 + EPS)
+
+    # concatenate all feature maps once, slices are not written into a preallocated
+    # tensor because in-place writes would break autograd through the saved conv inputs
+    compositeMat = torch.cat((struct_dis, GM_O, logOpponent, Ixy, logResponse, partialDer, GM), dim=1)
+
+    return blockproc(compositeMat, [block_size_h // scale, block_size_w // scale],
+                     fun=compute_feature,
+                     ilniqe=True,
+                     aggd_table=aggd_table)
+
+
+@lru_cache(maxsize=None)
+def _compiled_scale_features():
+    r"""Compile :func:`_ilniqe_scale_features` once, torch.compile caches the graphs of each
+    input shape by itself. Falls back to the eager function for torch without torch.compile.
+    The graph still breaks at the convergence check of :func:`fitweibull`, which reads a
+    device flag on the host.
+    """
+    if not hasattr(torch, 'compile'):
+        return _ilniqe_scale_features
+    return torch.compile(_ilniqe_scale_features, dynamic=False)
+
+
 def ilniqe(img: torch.Tensor,
            mu_pris_param: torch.Tensor,
            cov_pris_param: torch.Tensor,
@@ -207,7 +438,9 @@ def ilniqe(img: torch.Tensor,
            meanOfSampleData: torch.Tensor,
            resize: bool = True,
            block_size_h: int = 84,
-           block_size_w: int = 84) -> torch.Tensor:
+           block_size_w: int = 84,
+           use_autocast: bool = False,
+           use_compile: bool = False) -> torch.Tensor:
     """Calculate IL-NIQE (Integrated Local Natural Image Quality Evaluator) metric.
     Args:
         img (Tensor): Input image.
@@ -217,28 +450,30 @@ def ilniqe(img: torch.Tensor,
             Gaussian model calculated on the pristine dataset.
         principleVectors (Tensor): Features from official .mat file.
         meanOfSampleData (Tensor): Features from official .mat file.
-        resize (Bloolean): resize image. Default: True.
+        resize (bool): resize image. Default: True.
         block_size_h (int): Height of the blocks in to which image is divided.
             Default: 84 (the official recommended value).
         block_size_w (int): Width of the blocks in to which image is divided.
             Default: 84 (the official recommended value).
+        use_autocast (bool): run the Gaussian derivative convolutions of the opponent channels and
+            of the log-Gabor responses in bfloat16 with torch.autocast. Only takes effect for float32
+            inputs. The derivative maps are rounded to bfloat16 before their NSS statistics are computed,
+            so the scores drift from the float32 results. All other steps, including the downsampling
+            filter, run in the input precision. Default: False.
+        use_compile (bool): compile the per-scale feature extraction with torch.compile to fuse
+            its elementwise ops. Requires torch>=2.0, the eager path is used otherwise. Default: False.
+
+    The MVG fitting and distance are always computed in float64, where the conditioning
+    of the covariance matters, regardless of the input precision.
     """
     assert img.ndim == 4, ('Input image must be a gray or Y (of YCbCr) image with shape (b, c, h, w).')
+    if use_autocast:
+        autocast = partial(torch.autocast, device_type=img.device.type, dtype=torch.bfloat16)
+    else:
+        autocast = nullcontext
 
-    sigmaForGauDerivative = 1.66
-    KforLog = 0.00001
     normalizedWidth = 524
-    minWaveLength = 2.4
-    sigmaOnf = 0.55
-    mult = 1.31
-    dThetaOnSigma = 1.10
-    scaleFactorForLoG = 0.87
-    scaleFactorForGaussianDer = 0.28
     sigmaForDownsample = 0.9
-
-    EPS = 1e-8
-    scales = 3
-    orientations = 4
     infConst = 10000
     # nanConst = 2000
 
@@ -251,100 +486,42 @@ def ilniqe(img: torch.Tensor,
     num_block_h = math.floor(h / block_size_h)
     num_block_w = math.floor(w / block_size_w)
     img = img[..., 0:num_block_h * block_size_h, 0:num_block_w * block_size_w]
-    ospace_weight = torch.tensor([
-        [0.3, 0.04, -0.35],
-        [0.34, -0.6, 0.17],
-        [0.06, 0.63, 0.27],
-    ]).to(img)
-
-    O_img = img.permute(0, 2, 3, 1) @ ospace_weight.T
-    O_img = O_img.permute(0, 3, 1, 2)
-
+    ospace_weight, log_opponent_weight = _color_constants(img.dtype, img.device)
+
+    # color transform as a 1x1 conv, which keeps O_img contiguous for the following convs
+    O_img = F.conv2d(img, ospace_weight)
+
+    # build the two-scale pyramid first, so that the features of both scales can be computed independently.
+    # smooth the opponent and RGB channels together with one grouped conv, then downsample.
+    # not autocast, the RGB values of scale 2 go through log and would lose the bfloat16 mantissa
+    gauForDS = fspecial(math.ceil(6 * sigmaForDownsample), sigmaForDownsample, channels=6).to(img)
+    filterResult = imfilter(torch.cat((O_img, img), dim=1), gauForDS, padding='replicate', groups=6)
+    pyramid = {1: (O_img, img), 2: filterResult[..., ::2, ::2].chunk(2, dim=1)}
+
+    scale_features = partial(_compiled_scale_features() if use_compile else _ilniqe_scale_features,
+                             block_size_h=block_size_h,
+                             block_size_w=block_size_w,
+                             log_opponent_weight=log_opponent_weight,
+                             autocast=autocast)
+    # constant tensors are looked up outside of the (optionally compiled) feature extraction
+    gauss_kernel = _gauss_kernel(5, 5. / 6, img.dtype, img.device)
+    aggd_table = _aggd_lookup_table(img.dtype, img.device)
     distparam = []  # dist param is actually the multiscale features
-    for scale in (1, 2):  # perform on two scales (1, 2)
-        struct_dis = normalize_img_with_gauss(O_img[:, [2]], kernel_size=5, sigma=5. / 6, padding='replicate')
-
-        dx, dy = gauDerivative(sigmaForGauDerivative / (scale**scaleFactorForGaussianDer), device=img)
-
-        Ix = conv2d(O_img, dx.repeat(3, 1, 1, 1), groups=3)
-        Iy = conv2d(O_img, dy.repeat(3, 1, 1, 1), groups=3)
-        GM = torch.sqrt(Ix**2 + Iy**2 + EPS)
-        Ixy = torch.stack((Ix, Iy), dim=2).reshape(Ix.shape[0], Ix.shape[1] * 2,
-                                                   *Ix.shape[2:])  # reshape to (IxO1, IxO1, IxO2, IyO2, IxO3, IyO3)
-
-        logRGB = torch.log(img + KforLog)
-        logRGBMS = logRGB - logRGB.mean(dim=(2, 3), keepdim=True)
-
-        Intensity = logRGBMS.sum(dim=1, keepdim=True) / np.sqrt(3)
-        BY = (logRGBMS[:, [0]] + logRGBMS[:, [1]] - 2 * logRGBMS[:, [2]]) / np.sqrt(6)
-        RG = (logRGBMS[:, [0]] - logRGBMS[:, [1]]) / np.sqrt(2)
-
-        compositeMat = torch.cat([struct_dis, GM, Intensity, BY, RG, Ixy], dim=1)
-
-        O3 = O_img[:, [2]]
-        # gabor filter in shape (b, ori * scale, h, w)
-        LGFilters = _construct_filters(
-            O3,
-            scales=scales,
-            orientations=orientations,
-            min_length=minWaveLength / (scale**scaleFactorForLoG),
-            sigma_f=sigmaOnf,
-            mult=mult,
-            delta_theta=dThetaOnSigma,
-            use_lowpass_filter=False)
-        # reformat to scale * ori
-        b, _, h, w = LGFilters.shape
-        LGFilters = LGFilters.reshape(b, orientations, scales, h, w).transpose(1, 2).reshape(b, -1, h, w)
-        # TODO: current filters needs to be transposed to get same results as matlab, find the bug
-        LGFilters = LGFilters.transpose(-1, -2)
-        fftIm = torch.fft.fft2(O3)
-
-        logResponse = []
-        partialDer = []
-        GM = []
-        for index in range(LGFilters.shape[1]):
-            filter = LGFilters[:, [index]]
-            response = torch.fft.ifft2(filter * fftIm)
-            realRes = torch.real(response)
-            imagRes = torch.imag(response)
-
-            partialXReal = conv2d(realRes, dx)
-            partialYReal = conv2d(realRes, dy)
-            realGM = torch.sqrt(partialXReal**2 + partialYReal**2 + EPS)
-
-            partialXImag = conv2d(imagRes, dx)
-            partialYImag = conv2d(imagRes, dy)
-            imagGM = torch.sqrt(partialXImag**2 + partialYImag**2 + EPS)
-
-            logResponse.append(realRes)
-            logResponse.append(imagRes)
-            partialDer.append(partialXReal)
-            partialDer.append(partialYReal)
-            partialDer.append(partialXImag)
-            partialDer.append(partialYImag)
-            GM.append(realGM)
-            GM.append(imagGM)
-        logResponse = torch.cat(logResponse, dim=1)
-        partialDer = torch.cat(partialDer, dim=1)
-        GM = torch.cat(GM, dim=1)
-        compositeMat = torch.cat((compositeMat, logResponse, partialDer, GM), dim=1)
-
-        distparam.append(blockproc(compositeMat, [block_size_h // scale,
-                         block_size_w // scale], fun=compute_feature, ilniqe=True))
-
-        gauForDS = fspecial(math.ceil(6 * sigmaForDownsample), sigmaForDownsample).to(img)
-        filterResult = imfilter(O_img, gauForDS.repeat(3, 1, 1, 1), padding='replicate', groups=3)
-        O_img = filterResult[..., ::2, ::2]
-        filterResult = imfilter(img, gauForDS.repeat(3, 1, 1, 1), padding='replicate', groups=3)
-        img = filterResult[..., ::2, ::2]
+    for scale in (1, 2):
+        O_scale, img_scale = pyramid[scale]
+        dxy, LGFilters = _ilniqe_scale_filters(scale, O_scale.shape[-2:], img.dtype, img.device)
+        distparam.append(scale_features(O_scale, img_scale, dxy, LGFilters, gauss_kernel, aggd_table, scale=scale))
 
     distparam = torch.cat(distparam, dim=-1)  # b, block_num, feature_num
-    distparam[distparam > infConst] = infConst
+    # clamp keeps nan values, which are handled by nancov and nanmean below
+    distparam = distparam.clamp(max=infConst)
 
     # fit a MVG (multivariate Gaussian) model to distorted patch features
-    coefficientsViaPCA = torch.bmm(
-        principleVectors.transpose(1, 2), (distparam - meanOfSampleData.unsqueeze(1)).transpose(1, 2))
-    final_features = coefficientsViaPCA.transpose(1, 2)
+    # project the broadcast-centered features directly in (b, block_num, pca_dim) layout
+    final_features = torch.bmm(distparam - meanOfSampleData.unsqueeze(1), principleVectors)
+    final_features = final_features.to(torch.float64)
+    mu_pris_param = mu_pris_param.to(final_features)
+    cov_pris_param = cov_pris_param.to(final_features)
     b, blk_num, feat_num = final_features.shape
 
     # remove block features with nan and compute nonan cov
@@ -355,20 +532,40 @@ def ilniqe(img: torch.Tensor,
     final_features_withmu = torch.where(torch.isnan(final_features), mu_final_features, final_features)
 
     # compute ilniqe quality
-    invcov_param = torch.linalg.pinv((cov_pris_param + cov_distparam) / 2)
     diff = final_features_withmu - mu_pris_param.unsqueeze(1)
-    quality = (torch.bmm(diff, invcov_param) * diff).sum(dim=-1)
+    quality = _mahalanobis_sq(diff, (cov_pris_param + cov_distparam) / 2)
     quality = torch.sqrt(quality).mean(dim=1)
 
     return quality
 
 
+@lru_cache(maxsize=4)
+@torch.inference_mode(False)
+def _load_ilniqe_params(pretrained_model_path: str):
+    """Load the template model of ILNIQE, cached by model path.
+    Loaded outside of inference mode since the cached tensors are shared by all instances.
+    Args:
+        pretrained_model_path (str): The pretrained model path.
+    Returns:
+        tuple: mu_pris_param, cov_pris_param, meanOfSampleData and principleVectors, without batch dim.
+    """
+    params = scipy.io.loadmat(pretrained_model_path)
+    mu_pris_param = torch.from_numpy(np.ravel(params['templateModel'][0][0]))
+    cov_pris_param = torch.from_numpy(params['templateModel'][0][1])
+    meanOfSampleData = torch.from_numpy(np.ravel(params['templateModel'][0][2]))
+    principleVectors = torch.from_numpy(params['templateModel'][0][3])
+    return mu_pris_param, cov_pris_param, meanOfSampleData, principleVectors
+
+
 def calculate_ilniqe(img: torch.Tensor,
                      crop_border: int = 0,
                      mu_pris_param: torch.Tensor = None,
                      cov_pris_param: torch.Tensor = None,
                      principleVectors: torch.Tensor = None,
                      meanOfSampleData: torch.Tensor = None,
+                     precision: str = 'fp64',
+                     use_autocast: bool = False,
+                     use_compile: bool = False,
                      **kwargs) -> torch.Tensor:
     """Calculate IL-NIQE metric.
     Args:
@@ -376,24 +573,40 @@ def calculate_ilniqe(img: torch.Tensor,
         crop_border (int): Cropped pixels in each edge of an image. These
             pixels are not involved in the metric calculation.
         pretrained_model_path (str): The pretrained model path.
+        precision (str): Precision of the feature extraction, 'fp64' or 'fp32'.
+            'fp64' is consistent with matlab codes. 'fp32' is faster and is checked
+            against the official results with the same tolerance as 'fp64'. The MVG
+            distance is always computed in float64.
+            Default: 'fp64'.
+        use_autocast (bool): see :func:`ilniqe`. Default: False.
+        use_compile (bool): see :func:`ilniqe`. Default: False.
     Returns:
         Tensor: IL-NIQE result.
     """
 
     img = img * 255.
     img = diff_round(img)
+    assert precision in ('fp64', 'fp32'), f'Unsupported precision {precision}, should be fp64 or fp32'
     # float64 precision is critical to be consistent with matlab codes
-    img = img.to(torch.float64)
+    img = img.to(torch.float64 if precision == 'fp64' else torch.float32)
 
-    mu_pris_param = mu_pris_param.to(img).repeat(img.size(0), 1)
-    cov_pris_param = cov_pris_param.to(img).repeat(img.size(0), 1, 1)
-    meanOfSampleData = meanOfSampleData.to(img).repeat(img.size(0), 1)
-    principleVectors = principleVectors.to(img).repeat(img.size(0), 1, 1)
+    # broadcast views, ilniqe only reads the template model.
+    # pristine MVG parameters are kept in float64 for the final distance
+    mu_pris_param = mu_pris_param.to(img.device, torch.float64).expand(img.size(0), -1)
+    cov_pris_param = cov_pris_param.to(img.device, torch.float64).expand(img.size(0), -1, -1)
+    meanOfSampleData = meanOfSampleData.to(img).expand(img.size(0), -1)
+    principleVectors = principleVectors.to(img).expand(img.size(0), -1, -1)
 
     if crop_border != 0:
         img = img[..., crop_border:-crop_border, crop_border:-crop_border]
 
-    ilniqe_result = ilniqe(img, mu_pris_param, cov_pris_param, principleVectors, meanOfSampleData)
+    ilniqe_result = ilniqe(img,
+                           mu_pris_param,
+                           cov_pris_param,
+                           principleVectors,
+                           meanOfSampleData,
+                           use_autocast=use_autocast,
+                           use_compile=use_compile)
 
     return ilniqe_result
 
@@ -432,12 +645,10 @@ class NIQE(torch.nn.Module):
         elif version == 'matlab':
             pretrained_model_path = load_file_from_url(default_model_urls['niqe_matlab'])
 
-        # load model parameters
-        params = scipy.io.loadmat(pretrained_model_path)
-        mu_pris_param = np.ravel(params['mu_prisparam'])
-        cov_pris_param = params['cov_prisparam']
-        self.mu_pris_param = torch.from_numpy(mu_pris_param)
-        self.cov_pris_param = torch.from_numpy(cov_pris_param)
+        # load model parameters, kept as buffers so that they move with the module
+        mu_pris_param, cov_pris_param = _load_niqe_params(pretrained_model_path)
+        self.register_buffer('mu_pris_param', mu_pris_param, persistent=False)
+        self.register_buffer('cov_pris_param', cov_pris_param, persistent=False)
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         r"""Computation of NIQE metric.
@@ -458,32 +669,42 @@ class ILNIQE(torch.nn.Module):
         - crop_border (int): Cropped pixels in each edge of an image. These
         pixels are not involved in the metric calculation.
         - pretrained_model_path (str): The pretrained model path.
+        - precision (str): 'fp64' (consistent with matlab) or 'fp32' (faster).
+        - use_autocast (bool): run the ilniqe derivative convolutions in bfloat16, fp32 only.
+        - use_compile (bool): compile the ilniqe feature extraction with torch.compile.
     References:
         Zhang, Lin, Lei Zhang, and Alan C. Bovik. "A feature-enriched
         completely blind image quality evaluator." IEEE Transactions
         on Image Processing 24.8 (2015): 2579-2591.
     """
 
-    def __init__(self, channels: int = 3, crop_border: int = 0, pretrained_model_path: str = None) -> None:
+    def __init__(self,
+                 channels: int = 3,
+                 crop_border: int = 0,
+                 pretrained_model_path: str = None,
+                 precision: str = 'fp64',
+                 use_autocast: bool = False,
+                 use_compile: bool = False) -> None:
 
         super(ILNIQE, self).__init__()
         self.channels = channels
         self.crop_border = crop_border
+        assert precision in ('fp64', 'fp32'), f'Unsupported precision {precision}, should be fp64 or fp32'
+        self.precision = precision
+        self.use_autocast = use_autocast
+        self.use_compile = use_compile
         if pretrained_model_path is not None:
             self.pretrained_model_path = pretrained_model_path
         else:
             self.pretrained_model_path = load_file_from_url(default_model_urls['ilniqe'])
         
-        params = scipy.io.loadmat(self.pretrained_model_path)
-        mu_pris_param = np.ravel(params['templateModel'][0][0])
-        cov_pris_param = params['templateModel'][0][1]
-        meanOfSampleData = np.ravel(params['templateModel'][0][2])
-        principleVectors = params['templateModel'][0][3]
-
-        self.mu_pris_param = torch.from_numpy(mu_pris_param)
-        self.cov_pris_param = torch.from_numpy(cov_pris_param)
-        self.meanOfSampleData = torch.from_numpy(meanOfSampleData)
-        self.principleVectors = torch.from_numpy(principleVectors)
+        # load model parameters, kept as buffers so that they move with the module
+        mu_pris_param, cov_pris_param, meanOfSampleData, principleVectors = _load_ilniqe_params(
+            self.pretrained_model_path)
+        self.register_buffer('mu_pris_param', mu_pris_param, persistent=False)
+        self.register_buffer('cov_pris_param', cov_pris_param, persistent=False)
+        self.register_buffer('meanOfSampleData', meanOfSampleData, persistent=False)
+        self.register_buffer('principleVectors', principleVectors, persistent=False)
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         r"""Computation of NIQE metric.
@@ -493,5 +714,13 @@ class ILNIQE(torch.nn.Module):
             score (tensor): results of ilniqe metric, should be a positive real number. Shape :math:`(N, 1)`.
         """
         assert x.shape[1] == 3, 'ILNIQE only support input image with 3 channels'
-        score = calculate_ilniqe(x, self.crop_border, self.mu_pris_param, self.cov_pris_param, self.principleVectors, self.meanOfSampleData)
+        score = calculate_ilniqe(x,
+                                 self.crop_border,
+                                 self.mu_pris_param,
+                                 self.cov_pris_param,
+                                 self.principleVectors,
+                                 self.meanOfSampleData,
+                                 precision=self.precision,
+                                 use_autocast=self.use_autocast,
+                                 use_compile=self.use_compile)
         return score
@@ -1,8 +1,9 @@
 import math
+import warnings
 import numpy as np
 import torch
 import torch.nn.functional as F
-from .padding import ExactPadding2d, to_2tuple, symm_pad
+from .padding import exact_padding_2d, to_2tuple, symm_pad
 
 
 def fspecial(size=None, sigma=None, channels=1, filter_type='gaussian'):
@@ -37,10 +38,10 @@ def conv2d(input, weight, bias=None, stride=1, padding='same', dilation=1, group
         padding (str): padding mode
         dilation (int): conv dilation
     """
-    kernel_size = weight.shape[2:]
-    pad_func = ExactPadding2d(kernel_size, stride, dilation, mode=padding)
+    if padding is not None:
+        input = exact_padding_2d(input, weight.shape[2:], stride, dilation, mode=padding)
     weight = torch.flip(weight, dims=(-1, -2))
-    return F.conv2d(pad_func(input), weight, bias, stride, dilation=dilation, groups=groups)
+    return F.conv2d(input, weight, bias, stride, dilation=dilation, groups=groups)
 
 
 def imfilter(input, weight, bias=None, stride=1, padding='same', dilation=1, groups=1):
@@ -52,10 +53,10 @@ def imfilter(input, weight, bias=None, stride=1, padding='same', dilation=1, gro
         dilation (int): dilation of conv
         groups (int): groups of conv
     """
-    kernel_size = weight.shape[2:]
-    pad_func = ExactPadding2d(kernel_size, stride, dilation, mode=padding)
+    if padding is not None:
+        input = exact_padding_2d(input, weight.shape[2:], stride, dilation, mode=padding)
 
-    return F.conv2d(pad_func(input), weight, bias, stride, dilation=dilation, groups=groups)
+    return F.conv2d(input, weight, bias, stride, dilation=dilation, groups=groups)
 
 
 def filter2(input, weight, shape='same'):
@@ -115,7 +116,7 @@ def dct2d(x, norm='ortho'):
     return X2.transpose(-1, -2)
 
 
-def fitweibull(x, iters=50, eps=1e-2):
+def fitweibull(x, iters=50, eps=1e-2, sync_interval=None):
     """Simulate wblfit function in matlab.
 
     ref: https://github.com/mlosch/python-weibullfit/blob/master/weibull/backend_pytorch.py
@@ -124,17 +125,23 @@ def fitweibull(x, iters=50, eps=1e-2):
     :param x (tensor): (B, N), batch of samples from an (unknown) distribution. Each value must satisfy x > 0.
     :param iters: Maximum number of iterations
     :param eps: Stopping criterion. Fit is stopped ff the change within two iterations is smaller than eps.
-    :param use_cuda: Use gpu
+    :param sync_interval: Number of iterations between checks of the stopping criterion on the host.
+        Shape is frozen on device once converged, so results do not depend on this value. Checking
+        less often saves a device sync per iteration on CUDA, at the cost of up to sync_interval - 1
+        extra (frozen) Newton steps, and the memory of their graph under autograd. Default: None,
+        which checks every iteration on CPU, where the check is free, and every 10 iterations on CUDA.
     :return: Tuple (Shape, Scale) which can be (NaN, NaN) if a fit is impossible.
         Impossible fits may be due to 0-values in x.
     """
     ln_x = torch.log(x)
     k = 1.2 / torch.std(ln_x, dim=1, keepdim=True)
-    k_t_1 = k
+    converged = torch.zeros((), dtype=torch.bool, device=x.device)
+    if sync_interval is None:
+        sync_interval = 10 if x.is_cuda else 1
 
     for t in range(iters):
         # Partial derivative df/dk
-        x_k = x**k.repeat(1, x.shape[1])
+        x_k = x**k
         x_k_ln_x = x_k * ln_x
         ff = torch.sum(x_k_ln_x, dim=-1, keepdim=True)
         fg = torch.sum(x_k, dim=-1, keepdim=True)
@@ -146,14 +153,14 @@ def fitweibull(x, iters=50, eps=1e-2):
         f_prime = (ff_prime / fg - (ff / fg * fg_prime / fg)) + (1. / (k * k))
 
         # Newton-Raphson method k = k - f(k;x)/f'(k;x)
-        k = k - f / f_prime
-        error = torch.abs(k - k_t_1).max().item()
-        if error < eps:
-            break
         k_t_1 = k
+        k = torch.where(converged, k, k - f / f_prime)
+        converged = converged | (torch.abs(k - k_t_1).max() < eps)
+        if (t + 1) % sync_interval == 0 and converged.item():
+            break
 
     # Lambda (scale) can be calculated directly
-    lam = torch.mean(x**k.repeat(1, x.shape[1]), dim=-1, keepdim=True)**(1.0 / k)
+    lam = torch.mean(x**k, dim=-1, keepdim=True)**(1.0 / k)
 
     return torch.cat((k, lam), dim=1)  # Shape (SC), Scale (FE)
 
@@ -178,23 +185,30 @@ def nancov(x):
         cov (tensor): (B, feat_dim, feat_dim)
     """
     assert len(x.shape) == 3, f'Shape of input should be (batch_size, row_num, feat_dim), but got {x.shape}'
-    b, rownum, feat_dim = x.shape
-    nan_mask = torch.isnan(x).any(dim=2, keepdim=True)
-    cov_x = []
-    for i in range(b):
-        x_no_nan = x[i].masked_select(~nan_mask[i]).reshape(-1, feat_dim)
-        cov_x.append(cov(x_no_nan, rowvar=False))
-    return torch.stack(cov_x)
+    # rows with nan are zeroed out after centering instead of being removed,
+    # so that the covariance of the whole batch is computed with one bmm.
+    valid = ~torch.isnan(x).any(dim=2, keepdim=True)
+    num_valid = valid.sum(dim=1, keepdim=True).to(x.dtype)
+    x = torch.where(valid, x, torch.zeros_like(x))
+    mean = x.sum(dim=1, keepdim=True) / num_valid
+    centered = torch.where(valid, x - mean, torch.zeros_like(x))
+    # same correction as np.cov: unbiased unless there is only one observation
+    correction = (num_valid > 1).to(x.dtype)
+    return torch.bmm(centered.transpose(1, 2), centered) / (num_valid - correction)
 
 
 def nanmean(v, *args, inplace=False, **kwargs):
     r"""nanmean same as matlab function: calculate mean values by removing all nan.
+
+    Computed with the fused torch.nanmean reduction (torch>=1.10). ``inplace`` is deprecated: the
+    reduction no longer needs to zero the nan values of the input, it is only done for compatibility.
     """
-    if not inplace:
-        v = v.clone()
-    is_nan = torch.isnan(v)
-    v[is_nan] = 0
-    return v.sum(*args, **kwargs) / (~is_nan).float().sum(*args, **kwargs)
+    mean = torch.nanmean(v, *args, **kwargs)
+    if inplace:
+        warnings.warn('inplace of nanmean is deprecated and will be removed, the input does not need to be modified.',
+                      DeprecationWarning)
+        v.masked_fill_(torch.isnan(v), 0)
+    return mean
 
 
 def im2col(x, kernel, mode='sliding'):
@@ -272,11 +286,13 @@ def blockproc(x, kernel, fun, border_size=None, pad_partial=False, pad_method='z
         num_block_h = math.floor(h / block_size_h)
         num_block_w = math.floor(w / block_size_w)
 
-        # extract blocks in (row, column) manner, i.e., stored with column first
-        blocks = F.unfold(x, kernel, stride=kernel)
-        blocks = blocks.reshape(b, c, *kernel, num_block_h, num_block_w)
-        blocks = blocks.permute(5, 4, 0, 1, 2, 3).reshape(num_block_h * num_block_w * b, c, *kernel)
+        # extract blocks in (row, column) manner, i.e., stored with column first.
+        # Tensor.unfold returns a strided view in shape (b, c, num_block_h, num_block_w, kh, kw),
+        # so all blocks are gathered with a single copy and processed by one batched call.
+        # Blocks are kept batch-major, so results can be viewed as (b, block_num, ...) without a transpose.
+        blocks = x.unfold(2, block_size_h, block_size_h).unfold(3, block_size_w, block_size_w)
+        blocks = blocks.permute(0, 3, 2, 1, 4, 5).reshape(b * num_block_w * num_block_h, c, *kernel)
 
-        results = fun(blocks, func_args)
-        results = results.reshape(num_block_h * num_block_w, b, *results.shape[1:]).transpose(0, 1)
+        results = fun(blocks, **func_args)
+        results = results.reshape(b, num_block_h * num_block_w, *results.shape[1:])
         return results
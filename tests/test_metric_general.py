@@ -87,6 +87,19 @@ def test_match_official_with_given_cases(ref_img, dist_img, metric_name, device)
             f"Metric {metric_name} results mismatch with official results."
 
 
+@pytest.mark.calibration
+def test_ilniqe_fp32_match_official(dist_img, device):
+    """Test if the fp32 precision mode of ilniqe matches the official results
+    within the same tolerance as the default fp64 mode.
+    """
+    official_result = metrics_with_official_results()['ilniqe']
+    score = pyiqa.create_metric('ilniqe', device=device, precision='fp32')(dist_img)
+
+    atol, rtol = TOL_DICT['ilniqe']
+    assert torch.allclose(score.squeeze(), torch.from_numpy(official_result).to(score), atol=atol, rtol=rtol), \
+        "ilniqe fp32 results mismatch with official results."
+
+
 @pytest.mark.skipif(not torch.cuda.is_available(), reason="GPU not available")
 @pytest.mark.parametrize(
     ("metric_name"),
@@ -156,6 +169,30 @@ def test_gradient_backward(metric_name, device):
         torch.cuda.empty_cache()
 
 
+@pytest.mark.parametrize(
+    ("metric_name"),
+    ['niqe', 'ilniqe', 'brisque', 'piqe']
+)
+def test_gradient_backward_after_inference_mode(metric_name, device):
+    """Test if the constants cached by a call under torch.inference_mode can be
+    saved for backward by later calls.
+    """
+    from pyiqa.archs import func_util, niqe_arch
+
+    for cached in [func_util._gauss_kernel, func_util._aggd_lookup_table, niqe_arch._gau_derivative_kernels,
+                   niqe_arch._log_gabor_filters, niqe_arch._color_constants]:
+        cached.cache_clear()
+
+    x = torch.rand(1, 3, 224, 224).to(device)
+    metric = pyiqa.create_metric(metric_name, as_loss=True, device=device)
+    with torch.inference_mode():
+        metric(x)
+
+    x.requires_grad_()
+    metric(x).sum().backward()
+    assert torch.isnan(x.grad).sum() == 0, f"Metric {metric_name} cannot be used in backward after inference mode."
+
+
 @pytest.mark.parametrize(
     ("metric_name"),
     [(k) for k in pyiqa.list_models() if k not in ['fid', 'inception_score', 'clipscore']]
@@ -193,4 +230,45 @@ def test_forward(metric_name, device):
         del x
         del y
         del score
-        torch.cuda.empty_cache()
\ No newline at end of file
+        torch.cuda.empty_cache()
+
+
+@pytest.mark.skipif(not hasattr(torch, 'compile'), reason="torch.compile not available")
+def test_ilniqe_compile_match_eager():
+    """Test if the torch.compile path of ilniqe gives the same results as the eager path."""
+    from pyiqa.archs.niqe_arch import ilniqe
+
+    torch.manual_seed(0)
+    feat_dim = 8
+    img = torch.rand(1, 3, 168, 168, dtype=torch.float64) * 255
+    mu_pris_param = torch.rand(1, feat_dim, dtype=torch.float64)
+    basis = torch.randn(1, feat_dim, feat_dim, dtype=torch.float64)
+    cov_pris_param = basis @ basis.transpose(1, 2) + torch.eye(feat_dim, dtype=torch.float64)
+    principleVectors = torch.randn(1, 468, feat_dim, dtype=torch.float64)
+    meanOfSampleData = torch.rand(1, 468, dtype=torch.float64)
+    params = (mu_pris_param, cov_pris_param, principleVectors, meanOfSampleData)
+
+    score_eager = ilniqe(img, *params, resize=False)
+    score_compile = ilniqe(img, *params, resize=False, use_compile=True)
+    assert torch.allclose(score_compile, score_eager, atol=1e-6, rtol=1e-6), \
+        "ilniqe results mismatch between compiled and eager mode."
+
+
+def test_mahalanobis_sq_non_pd_cov():
+    """Test if the squared Mahalanobis distance of niqe and ilniqe falls back to the pseudo inverse
+    when the covariance is not positive definite.
+    """
+    from pyiqa.archs.niqe_arch import _mahalanobis_sq
+
+    diff = torch.randn(2, 5, 4, dtype=torch.float64)
+    # singular covariance, which has no cholesky factor
+    cov = torch.diag_embed(torch.tensor([[1., 2., 3., 0.], [2., 1., 0., 0.]], dtype=torch.float64))
+    dist = _mahalanobis_sq(diff, cov)
+    expected = (diff @ torch.linalg.pinv(cov) * diff).sum(dim=-1)
+    assert torch.allclose(dist, expected), "Mahalanobis distance mismatch with the pseudo inverse."
+
+    # positive definite covariance goes through the cholesky solve
+    cov = cov + torch.eye(4, dtype=torch.float64)
+    dist = _mahalanobis_sq(diff, cov)
+    expected = (diff @ torch.linalg.inv(cov) * diff).sum(dim=-1)
+    assert torch.allclose(dist, expected), "Mahalanobis distance mismatch with the inverse."